@@ -1,5 +1,10 @@
 #!/usr/bin/env python
 import getopt, sys, os, subprocess
+import atexit, shutil, signal, tempfile
+import multiprocessing
+from array import array
+import hashlib
+from collections import OrderedDict, defaultdict
 
 # This is used for minimizing the number of strings.
 import re, string
@@ -22,10 +27,24 @@ Options:
 * --char (-c).
       Don't treat lines as atomic units; treat the file as a sequence
       of characters rather than a sequence of lines.
-* --strategy=[minimize, remove-pair, remove-substring, check-only].
+* --strategy=[minimize, ddmin, remove-pair, remove-substring, check-only].
       default: minimize.
 * --testcase=filename.
       default: last thing on the command line, which can double as passing in.
+* --testcase-tmpfs.
+      Keep the testcase in memory (in /dev/shm) while reducing it, leaving a
+      symbolic link in its place until Lithium exits.  The original file is
+      kept as <testcase>.lithium-orig in the meantime.
+* --no-temp.
+      Don't save a copy of each tested file in the temp directory.
+* --temp-buffer-mb=n. default: 64.
+      Copies of the files which turned out to be uninteresting are kept in
+      memory, and the oldest ones are saved once they take more than n MB.
+      The rest are saved when Lithium exits, but lost if it is killed.
+* --cache.
+      Remember the outcome of each test, and skip running the condition
+      again on a testcase identical to one already tested.  Only use it
+      if the condition is deterministic.
 
 Additional options for the default strategy (--strategy=minimize)
 * --repeat=[always, last, never]. default: last
@@ -35,6 +54,9 @@ Additional options for the default strategy (--strategy=minimize)
      What chunk sizes to test.  Must be powers of two.
 * --chunksize=n
      Shortcut for "repeat=never, min=n, max=n"
+* --jobs=n. default: 1.
+     How many chunk removals to test at once.  The testcase has to be one
+     of the condition arguments, as each job tests its own copy of it.
 
 See doc/using.html for more information.
 
@@ -51,35 +73,58 @@ minimizeMax = pow(2, 30)
 atom = "line"
 cutAfter = "?=;{["
 cutBefore = "]}:"
+cutter = None
 
 conditionScript = None
 conditionArgs = None
 testcaseFilename = None
 testcaseExtension = ""
+testcaseOnStdin = False
+useTmpfs = False
 
 testCount = 0
 testTotal = 0
 
 tempDir = None
 tempFileCount = 1
+keepTempFiles = True
+tempBuffer = OrderedDict()
+tempBufferSize = 0
+tempBufferLimit = 64 * 1024 * 1024
+
+lastInterestingDigest = None
+lastInterestingData = None
+
+useCache = False
+cacheLimit = 10000
+interestingCache = OrderedDict()
+
+jobs = 1
+jobPool = None
+jobTestcases = []
+jobConditionArgs = []
 
 before = ""
 after = ""
 parts = []
 
+bracketBalances = {}
+
 
 # Main and friends
 
 def main():
-    global conditionScript, conditionArgs, testcaseFilename, testcaseExtension, strategy
+    global conditionScript, conditionArgs, testcaseFilename, testcaseExtension, testcaseOnStdin, strategy
     global parts
+    global minimizeMin, minimizeMax
 
     try:
         opts, args = getopt.getopt(sys.argv[1:], "hcs", [
             "help",
             "char", "symbols", "cutBefore=", "cutAfter=",
             "strategy=", "repeat=", "min=", "max=", "chunksize=",
-            "testcase=", "tempdir="])
+            "testcase=", "testcase-tmpfs", "tempdir=", "no-temp", "temp-buffer-mb=",
+            "cache", "jobs="])
     except getopt.GetoptError, exc:
         usageError(exc.msg)
 
@@ -102,6 +147,8 @@ def main():
     if hasattr(conditionScript, "init"):
         conditionScript.init(conditionArgs)
 
+    testcaseOnStdin = getattr(conditionScript, "acceptsStdin", False)
+
     e = testcaseFilename.rsplit(".", 1)
     if len(e) > 1:
         testcaseExtension = "." + e[1]
@@ -109,9 +156,23 @@ def main():
 
     readTestcase()
 
+    # Chunks larger than the whole testcase would not be any different.
+    minimizeMax = min(minimizeMax, 2 * largestPowerOfTwoSmallerThan(len(parts)))
+    minimizeMin = min(minimizeMin, minimizeMax)
+
     if tempDir == None:
         createTempDir()
         print "Intermediate files will be stored in " + tempDir + os.sep + "."
+    atexit.register(flushTempBuffer)
+
+    if jobs > 1:
+        createJobs()
+
+    # Only once the workers are forked, so that they are not affected.
+    catchExitSignals()
+
+    if useTmpfs:
+        moveTestcaseToTmpfs()
 
     if strategy == "check-only":
         print 'Interesting.' if interesting(parts) else 'Not interesting.'
@@ -123,6 +184,7 @@ def main():
         'minimize-balanced': minimizeBalancedPairs,
         'replace-properties-by-globals': replacePropertiesByGlobals,
         'replace-arguments-by-globals': replaceArgumentsByGlobals,
+        'ddmin': ddmin,
         'remove-pair': tryRemovingPair,
         'remove-adjacent-pairs': tryRemovingAdjacentPairs,
         'remove-substring': tryRemovingSubstring
@@ -144,7 +206,8 @@ def main():
 
 
 def processOptions(opts):
-    global atom, cutBefore, cutAfter, minimizeRepeat, minimizeMin, minimizeMax, strategy, testcaseFilename, tempDir
+    global atom, cutBefore, cutAfter, cutter, minimizeRepeat, minimizeMin, minimizeMax, strategy, testcaseFilename, tempDir
+    global useCache, jobs, useTmpfs, keepTempFiles, tempBufferLimit
 
     for o, a in opts:
         if o in ("-h", "--help"):
@@ -152,15 +215,25 @@ def processOptions(opts):
             sys.exit(0)
         elif o == "--testcase":
             testcaseFilename = a
+        elif o == "--testcase-tmpfs":
+            useTmpfs = True
+            if not hasattr(os, "symlink"):
+                usageError("testcase-tmpfs requires symbolic links.")
         elif o == "--tempdir":
             tempDir = a
+        elif o == "--no-temp":
+            keepTempFiles = False
+        elif o == "--temp-buffer-mb":
+            tempBufferLimit = int(a) * 1024 * 1024
+        elif o == "--cache":
+            useCache = True
         elif o in ("-c", "--char"): 
             atom = "char"
         elif o in ("-s", "--symbols"):
             atom = "symbol-delimiter"
-        elif o in ("--cut-after"):
+        elif o == "--cutAfter":
             cutAfter = str(a)
-        elif o in ("--cut-before"):
+        elif o == "--cutBefore":
             cutBefore = str(a)
         elif o == "--strategy":
             strategy = a
@@ -182,6 +255,18 @@ def processOptions(opts):
             minimizeRepeat = "never"
             if not isPowerOfTwo(minimizeMin):
                 usageError("Chunk size must be a power of two.")
+        elif o == "--jobs":
+            jobs = int(a)
+            if jobs < 1:
+                usageError("jobs must be at least 1.")
+            if jobs > 1 and os.name != "posix":
+                usageError("jobs are only supported on POSIX systems.")
+
+    # Split symbols after the cutAfter characters and before the cutBefore
+    # characters.  The pattern is the same for every line.
+    cutter = re.compile('[' + re.escape(cutBefore) + ']?' +
+                        '[^' + re.escape(cutBefore + cutAfter) + ']*' +
+                        '(?:[' + re.escape(cutAfter) + ']|$|(?=[' + re.escape(cutBefore) + ']))')
 
 
 def usageError(s):
@@ -196,7 +281,7 @@ def readTestcase():
     hasDDSection = False
 
     try:
-        file = open(testcaseFilename, "r")
+        file = open(testcaseFilename, "rb")
     except IOError:
         usageError("Can't read the original testcase file, " + testcaseFilename + "!")
     
@@ -218,8 +303,12 @@ def readTestcase():
     else:
         # Reduce the entire file.
         #print "Testcase does not have a DD section"
-        for line in file:
-            readTestcaseLine(line)
+        if atom == "char":
+            # No need to split the file into lines first.
+            readTestcaseLine(file.read())
+        else:
+            for line in file:
+                readTestcaseLine(line)
         
     file.close()
 
@@ -233,14 +322,21 @@ def readTestcaseWithDDSection(file):
         if line.find("DDBEGIN") != -1:
             break
 
+    section = []
     for line in file:
         if line.find("DDEND") != -1:
             after += line
             break
-        readTestcaseLine(line)
+        section.append(line)
     else:
         usageError("The testcase (" + testcaseFilename + ") has a line containing 'DDBEGIN' but no line containing 'DDEND'.")
 
+    if atom == "char":
+        readTestcaseLine("".join(section))
+    else:
+        for line in section:
+            readTestcaseLine(line)
+
     for line in file:
         after += line
     
@@ -258,78 +354,298 @@ def readTestcaseLine(line):
     if atom == "line":
        parts.append(line)
     elif atom == "char":
-        for char in line:
-            parts.append(char)
+        parts.extend(line)
     elif atom == "symbol-delimiter":
-        cutter = '[' + cutBefore + ']?[^' + cutBefore + cutAfter + ']*(?:[' + cutAfter + ']|$|(?=[' + cutBefore + ']))'
-        for statement in re.finditer(cutter, line):
+        for statement in cutter.finditer(line):
             parts.append(statement.group(0))
 
-def writeTestcase(filename):
-    file = open(filename, "w")
-    file.write(before)
-    for i in range(len(parts)):
-        file.write(parts[i])
-    file.write(after)
-    file.close()
+def writeTestcase(filename, removed=[]):
+    writeData(filename, testcaseData(removed))
 
-def writeTestcaseTemp(partialFilename, useNumber):
-    global tempFileCount
+def writeData(filename, data):
+    # Write the bytes as they are, without going through a file object, nor
+    # translating line breaks on Windows.
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0666)
+    try:
+        written = 0
+        while written < len(data):
+            written += os.write(fd, buffer(data, written))
+    finally:
+        os.close(fd)
+
+def writeTestcaseTemp(partialFilename, useNumber, data=None, buffered=False):
+    global tempFileCount, tempBufferSize
     if useNumber:
         partialFilename = str(tempFileCount) + "-" + partialFilename
         tempFileCount += 1
-    writeTestcase(tempDir + os.sep + partialFilename + testcaseExtension)
+    if not keepTempFiles:
+        return
+    filename = tempDir + os.sep + partialFilename + testcaseExtension
+    if data == None:
+        data = testcaseData()
+    if not buffered:
+        writeData(filename, data)
+        return
+
+    # Keep the copy in memory, and write the oldest copies once the buffer is
+    # full.  The rest of the buffer is written to the temp directory on exit.
+    tempBuffer[filename] = data
+    tempBufferSize += len(data)
+    while tempBufferSize > tempBufferLimit:
+        (oldFilename, oldData) = tempBuffer.popitem(last=False)
+        writeData(oldFilename, oldData)
+        tempBufferSize -= len(oldData)
+
+def flushTempBuffer():
+    global tempBufferSize
+    for (filename, data) in tempBuffer.items():
+        writeData(filename, data)
+    tempBuffer.clear()
+    tempBufferSize = 0
+
+def keptRanges(removed):
+    """Yield the ranges of parts which are not within the removed ranges.
+
+    The removed ranges are (start, end) pairs sorted by start, which can
+    touch but do not overlap."""
+    start = 0
+    for (removedStart, removedEnd) in removed:
+        if start < removedStart:
+            yield (start, removedStart)
+        start = removedEnd
+    if start < len(parts):
+        yield (start, len(parts))
+
+def testcaseData(removed=[]):
+    data = [before]
+    for (start, end) in keptRanges(removed):
+        data.append("".join(parts[start:end]))
+    data.append(after)
+    return "".join(data)
+
+def partsWithout(removed):
+    kept = []
+    for (start, end) in keptRanges(removed):
+        kept.extend(parts[start:end])
+    return kept
 
 
 def createTempDir():
     global tempDir
-    i = 1
-    while 1:
-        tempDir = "tmp" + str(i)
-        # To avoid race conditions, we use try/except instead of exists/create
-        # Hopefully we don't get any errors other than "File exists" :)
-        try:
-            os.mkdir(tempDir)
-            break
-        except OSError, e:
-            i += 1
+    # Honors TMPDIR, so that intermediate files can be kept in memory with
+    # TMPDIR=/dev/shm.
+    tempDir = tempfile.mkdtemp(prefix="lithium-")
+
+
+def createJobs():
+    """Give each job its own copy of the testcase, and start the workers."""
+    global jobPool
+
+    if testcaseFilename not in conditionArgs and not testcaseOnStdin:
+        usageError("--jobs requires the testcase to be one of the condition arguments.")
+
+    for i in range(jobs):
+        # The temp directory may be reused with --tempdir, so pick fresh names.
+        jobDir = tempfile.mkdtemp(prefix="job" + str(i + 1) + "-", dir=tempDir)
+        jobTestcase = jobDir + os.sep + os.path.basename(testcaseFilename)
+        jobTestcases.append(jobTestcase)
+        jobConditionArgs.append([jobTestcase if arg == testcaseFilename else arg for arg in conditionArgs])
+
+    # The workers are forked, so they inherit the condition script as it is
+    # after its init function.
+    jobPool = multiprocessing.Pool(jobs)
+
+
+def exitOnSignal(signum, frame):
+    sys.exit("Exiting on signal " + str(signum) + ".")
+
+def catchExitSignals():
+    """Turn SIGTERM and SIGHUP into a normal exit, so that the atexit handlers
+    still run.  Nothing can be done about SIGKILL."""
+    for name in ("SIGTERM", "SIGHUP"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), exitOnSignal)
+
+
+def moveTestcaseToTmpfs():
+    """Move the testcase to a memory file system, and leave a symbolic link to
+    it in its place, for the condition.  The testcase gets back in place when
+    Lithium exits, and the original file is kept under a backup name until
+    then, in case Lithium is killed."""
+    global testcaseFilename
+
+    tmpfsDir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    (fd, tmpfsFilename) = tempfile.mkstemp(prefix="lithium-", suffix=testcaseExtension, dir=tmpfsDir)
+    os.close(fd)
+    shutil.copy2(testcaseFilename, tmpfsFilename)
+    backupFilename = testcaseFilename + ".lithium-orig"
+    shutil.copy2(testcaseFilename, backupFilename)
+
+    # Replace the testcase by the link atomically, so it is never missing.
+    link = testcaseFilename + ".lithium-link"
+    os.symlink(tmpfsFilename, link)
+    atexit.register(restoreTestcaseFromTmpfs, testcaseFilename, tmpfsFilename, backupFilename)
+    os.rename(link, testcaseFilename)
+
+    print "The testcase is kept in " + tmpfsFilename + " until Lithium exits."
+    print "The original testcase is kept in " + backupFilename + " until then."
+    testcaseFilename = tmpfsFilename
+
+def restoreTestcaseFromTmpfs(filename, tmpfsFilename, backupFilename):
+    # The file in memory may hold the last tested (possibly boring) variant if
+    # Lithium was interrupted, so put back the last interesting one.
+    if os.path.islink(filename):
+        os.remove(filename)
+    writeData(filename, lastInterestingData if lastInterestingData != None else testcaseData())
+    os.remove(tmpfsFilename)
+    os.remove(backupFilename)
 
 
 # Interestingness test
 
 def interesting(partsSuggestion):
-    global tempFileCount, testcaseFilename, conditionArgs
-    global testCount, testTotal
     global parts
+
     oldParts = parts # would rather be less side-effecty about this, and be passing partsSuggestion around
     parts = partsSuggestion
+    inter = interestingWithout([])
+    if not inter:
+        parts = oldParts
+    return inter
 
-    writeTestcase(testcaseFilename)
+
+def interestingWithout(removed):
+    """Test the testcase made of the current parts, except the removed ranges.
+
+    Unlike interesting(), this does not change parts."""
+
+    global tempFileCount, testcaseFilename, conditionArgs
+    global testCount, testTotal
+    global lastInterestingDigest, lastInterestingData
+
+    # The testcase is rendered once, and the same string is hashed, written
+    # and copied to the temp directory.
+    data = testcaseData(removed)
+    digest = testcaseDigest(data)
+    if digest == lastInterestingDigest:
+        print "Skipping a testcase identical to the last interesting one."
+        return True
+
+    if useCache:
+        inter = cachedAnswer(digest)
+        if inter != None:
+            print "Skipping a testcase which was already tested."
+            return inter
 
     testCount += 1
-    testTotal += len(parts)
+    testTotal += len(parts) - numRemoved(removed)
 
     tempPrefix = tempDir + os.sep + str(tempFileCount)
-    inter = conditionScript.interesting(conditionArgs, tempPrefix)
+    if testcaseOnStdin:
+        inter = conditionScript.interesting(conditionArgs, tempPrefix, data)
+    else:
+        writeData(testcaseFilename, data)
+        inter = conditionScript.interesting(conditionArgs, tempPrefix)
 
     # Save an extra copy of the file inside the temp directory.
     # This is useful if you're reducing an assertion and encounter a crash:
     # it gives you a way to try to reproduce the crash.
+    # Copies of uninteresting files are rarely looked at, so they are buffered.
     if tempDir != None:
         tempFileTag = "interesting" if inter else "boring"
-        writeTestcaseTemp(tempFileTag, True)
+        writeTestcaseTemp(tempFileTag, True, data, buffered=not inter)
 
-    if not inter:
-        parts = oldParts
+    if useCache:
+        cacheAnswer(digest, inter)
+
+    if inter:
+        lastInterestingDigest = digest
+        lastInterestingData = data
     return inter
 
 
+def interestingInParallel(removals):
+    """Test each of the removals in its own job.
+
+    Returns the list of answers, without changing parts."""
+
+    global tempFileCount
+    global testCount, testTotal
+    global lastInterestingDigest, lastInterestingData
+
+    answers = [None] * len(removals)
+    datas = [testcaseData(removed) for removed in removals]
+    digests = [testcaseDigest(data) for data in datas]
+    tests = []
+    for i, removed in enumerate(removals):
+        if useCache:
+            answers[i] = cachedAnswer(digests[i])
+            if answers[i] != None:
+                print "Skipping a testcase which was already tested."
+                continue
+        if not testcaseOnStdin:
+            writeData(jobTestcases[len(tests)], datas[i])
+        tests.append(i)
+        testCount += 1
+        testTotal += len(parts) - numRemoved(removed)
+
+    jobArgs = []
+    for j in range(len(tests)):
+        tempPrefix = tempDir + os.sep + str(tempFileCount + j)
+        if testcaseOnStdin:
+            jobArgs.append((conditionArgs, tempPrefix, datas[tests[j]]))
+        else:
+            jobArgs.append((jobConditionArgs[j], tempPrefix))
+
+    # Waiting with a timeout keeps the main process responsive to ^C.
+    results = jobPool.map_async(runJob, jobArgs).get(sys.maxint)
+
+    for j, i in enumerate(tests):
+        answers[i] = results[j]
+        tempFileTag = "interesting" if results[j] else "boring"
+        writeTestcaseTemp(tempFileTag, True, datas[i], buffered=not results[j])
+        if useCache:
+            cacheAnswer(digests[i], results[j])
+
+    # The caller keeps the first interesting removal.
+    for i, inter in enumerate(answers):
+        if inter:
+            lastInterestingDigest = digests[i]
+            lastInterestingData = datas[i]
+            break
+    return answers
+
+
+def runJob(jobArgs):
+    return conditionScript.interesting(*jobArgs)
+
+
+def testcaseDigest(data):
+    """Hash the content of a testcase."""
+    return hashlib.sha1(data).digest()
+
+def cachedAnswer(digest):
+    """Return the cached answer for a testcase, or None if it was not tested."""
+    inter = interestingCache.pop(digest, None)
+    if inter != None:
+        interestingCache[digest] = inter
+    return inter
+
+def cacheAnswer(digest, inter):
+    interestingCache[digest] = inter
+    if len(interestingCache) > cacheLimit:
+        interestingCache.popitem(last=False)
+
+def numRemoved(removed):
+    return sum([end - start for (start, end) in removed])
+
+
 # Main reduction algorithm
 
 def minimize():
     origNumParts = len(parts)
     chunkSize = min(minimizeMax, largestPowerOfTwoSmallerThan(origNumParts))
-    finalChunkSize = max(minimizeMin, 1)
+    finalChunkSize = min(chunkSize, max(minimizeMin, 1))
     
     while 1:
         anyChunksRemoved = tryRemovingChunks(chunkSize);
@@ -343,8 +659,9 @@ def minimize():
             # Done
             break
         else:
-            # Continue with the next smaller chunk size
-            chunkSize /= 2
+            # Continue with the next smaller chunk size, skipping the sizes
+            # which are too large for what remains of the testcase.
+            chunkSize = max(finalChunkSize, min(chunkSize / 2, largestPowerOfTwoSmallerThan(len(parts))))
 
     writeTestcase(testcaseFilename)
     
@@ -377,32 +694,118 @@ def tryRemovingChunks(chunkSize):
     print "Starting a round with chunks of " + quantity(chunkSize, atom) + "."
 
     
-    numChunks = divideRoundingUp(len(parts), chunkSize)
+    # Chunks are only marked as removed during the round, so the chunk
+    # boundaries stay the same and parts is rebuilt once at the end.
+    numAtoms = len(parts)
+    numChunks = divideRoundingUp(numAtoms, chunkSize)
+    removed = []
     chunkStart = 0
-    while chunkStart < len(parts):
 
-        chunksSoFar += 1
-        chunkEnd = min(len(parts), chunkStart + chunkSize)
-        description = "chunk #" + str(chunksSoFar) + " of " + str(numChunks) + " chunks of size " + str(chunkSize)
-        
-        if interesting(parts[:chunkStart] + parts[chunkEnd:]):
-            print "Yay, reduced it by removing " + description + " :)"
-            chunksRemoved += 1
-            atomsRemoved += (chunkEnd - chunkStart)
-            summary += '-';
-            # leave chunkStart the same
+    # Large prefixes and suffixes are often removable, so the chunks at each
+    # end of the testcase are tried first, doubling the number of chunks
+    # removed at once as long as the testcase stays interesting.  This is only
+    # done with the largest chunk size, as the ends were otherwise already
+    # tried as larger chunks.  The removed suffix is kept apart, as removed
+    # has to stay sorted.
+    tail = []
+    tailMark = '-'
+    scanEnd = numAtoms
+    if numChunks >= 4 and chunkSize >= minimizeMax:
+        prefixChunks = tryRemovingEnd(chunkSize, numChunks, removed, True, numChunks - 1)
+        if prefixChunks > 0:
+            chunkStart = prefixChunks * chunkSize
+            removed.append((0, chunkStart))
+            chunksRemoved += prefixChunks
+            atomsRemoved += chunkStart
+            for i in range(prefixChunks):
+                chunksSoFar += 1
+                summary += '-';
+                if chunksSoFar % 2 == 0:
+                    summary += " ";
         else:
-            print "Removing " + description + " made the file 'uninteresting'."
+            chunkStart = chunkSize
             chunksSurviving += 1
-            atomsSurviving += (chunkEnd - chunkStart)
+            atomsSurviving += chunkSize
+            chunksSoFar += 1
             summary += 'S';
+
+        suffixChunks = tryRemovingEnd(chunkSize, numChunks, removed, False, numChunks - prefixChunks - 1)
+        if suffixChunks > 0:
+            scanEnd = (numChunks - suffixChunks) * chunkSize
+            tail = [(scanEnd, numAtoms)]
+            chunksRemoved += suffixChunks
+            atomsRemoved += numAtoms - scanEnd
+        elif prefixChunks < numChunks - 1:
+            scanEnd = (numChunks - 1) * chunkSize
+            tailMark = 'S'
+            chunksSurviving += 1
+            atomsSurviving += numAtoms - scanEnd
+
+    while chunkStart < scanEnd:
+
+        # With several jobs, test the next chunks at once.
+        window = []
+        while len(window) < jobs and chunkStart + len(window) * chunkSize < scanEnd:
+            windowStart = chunkStart + len(window) * chunkSize
+            window.append((windowStart, min(scanEnd, windowStart + chunkSize)))
+
+        if len(window) > 1:
+            # Most chunks are removed early on, so first try to remove all the
+            # chunks of the window with a single test.
+            windowEnd = window[-1][1]
+            description = "chunks #" + str(chunksSoFar + 1) + " to #" + str(chunksSoFar + len(window)) + " of " + str(numChunks) + " chunks of size " + str(chunkSize)
+            if interestingWithout(removed + [(chunkStart, windowEnd)] + tail):
+                print "Yay, reduced it by removing " + description + " :)"
+                removed.append((chunkStart, windowEnd))
+                for (windowStart, windowEnd) in window:
+                    chunksSoFar += 1
+                    chunksRemoved += 1
+                    atomsRemoved += (windowEnd - windowStart)
+                    summary += '-';
+                    if chunksSoFar % 2 == 0:
+                        summary += " ";
+                chunkStart = windowEnd
+                continue
+            print "Removing " + description + " made the file 'uninteresting'."
+            answers = interestingInParallel([removed + [chunk] + tail for chunk in window])
+        else:
+            answers = [interestingWithout(removed + window + tail)]
+
+        for (s, e), inter in zip(window, answers):
+            chunksSoFar += 1
+            description = "chunk #" + str(chunksSoFar) + " of " + str(numChunks) + " chunks of size " + str(chunkSize)
             chunkStart += chunkSize
 
-        # Put a space between each pair of chunks in the summary.
-        # During 'minimize', this is useful because it shows visually which 
-        # chunks used to be part of a single larger chunk.
+            if inter:
+                print "Yay, reduced it by removing " + description + " :)"
+                chunksRemoved += 1
+                atomsRemoved += (e - s)
+                summary += '-';
+                removed.append((s, e))
+            else:
+                print "Removing " + description + " made the file 'uninteresting'."
+                chunksSurviving += 1
+                atomsSurviving += (e - s)
+                summary += 'S';
+
+            # Put a space between each pair of chunks in the summary.
+            # During 'minimize', this is useful because it shows visually which 
+            # chunks used to be part of a single larger chunk.
+            if chunksSoFar % 2 == 0:
+                summary += " ";
+
+            # The answers past the first removal are no longer relevant.
+            if inter:
+                break
+
+    # Add the chunks at the end of the testcase, which were tried first.
+    while chunksSoFar < numChunks:
+        chunksSoFar += 1
+        summary += tailMark;
         if chunksSoFar % 2 == 0:
             summary += " ";
+
+    parts = partsWithout(removed + tail)
   
     print ""
     print "Done with a round of chunk size " + str(chunkSize) + "!"
@@ -418,6 +821,31 @@ def tryRemovingChunks(chunkSize):
     return (chunksRemoved > 0)
 
 
+def tryRemovingEnd(chunkSize, numChunks, removed, atStart, maxChunks):
+    """Try removing 1, 2, 4, 8, ... chunks at the start or at the end of the
+    testcase, as long as it stays interesting.
+
+    Returns the number of chunks which can be removed."""
+
+    numAtoms = len(parts)
+    removable = 0
+    count = 1
+    while count <= maxChunks:
+        if atStart:
+            description = "the first " + str(count) + " of " + str(numChunks) + " chunks of size " + str(chunkSize)
+            trial = removed + [(0, count * chunkSize)]
+        else:
+            description = "the last " + str(count) + " of " + str(numChunks) + " chunks of size " + str(chunkSize)
+            trial = removed + [((numChunks - count) * chunkSize, numAtoms)]
+        if not interestingWithout(trial):
+            print "Removing " + description + " made the file 'uninteresting'."
+            break
+        print "Yay, reduced it by removing " + description + " :)"
+        removable = count
+        count *= 2
+
+    return removable
+
 
 #
 # This Strategy attempt at removing pairs of chuncks which might be surrounding
@@ -434,7 +862,7 @@ def tryRemovingChunks(chunkSize):
 def minimizeSurroundingPairs():
     origNumParts = len(parts)
     chunkSize = min(minimizeMax, largestPowerOfTwoSmallerThan(origNumParts))
-    finalChunkSize = max(minimizeMin, 1)
+    finalChunkSize = min(chunkSize, max(minimizeMin, 1))
 
     while 1:
         anyChunksRemoved = tryRemovingSurroundingChunks(chunkSize);
@@ -448,8 +876,9 @@ def minimizeSurroundingPairs():
             # Done
             break
         else:
-            # Continue with the next smaller chunk size
-            chunkSize /= 2
+            # Continue with the next smaller chunk size, skipping the sizes
+            # which are too large for what remains of the testcase.
+            chunkSize = max(finalChunkSize, min(chunkSize / 2, largestPowerOfTwoSmallerThan(len(parts))))
 
     writeTestcase(testcaseFilename)
     
@@ -463,18 +892,53 @@ def minimizeSurroundingPairs():
     print "  Tests performed: " + str(testCount)
     print "  Test total: " + quantity(testTotal, atom)
 
-def list_rindex(l, p, e):
-    if p < 0 or p > len(l):
-        raise ValueError("%s is not in list" % str(e))
-    for index, item in enumerate(reversed(l[:p])):
-        if item == e:
-            return p - index - 1
-    raise ValueError("%s is not in list" % str(e))
-
-def list_nindex(l, p, e):
-    if p + 1 >= len(l):
-        raise ValueError("%s is not in list" % str(e))
-    return l[(p + 1):].index(e) + (p + 1)
+# The surviving chunks of a summary are doubly linked, so that finding the
+# surviving chunk before or after a chunk does not scan the summary.
+
+def printableSummary(summary):
+    """Put a space between each pair of chunks of a summary."""
+    return " ".join([str(summary[i:(i + 2)]) for i in range(0, len(summary), 2)])
+
+def survivorLinks(summary):
+    nextIdx = array('i', [len(summary)] * len(summary))
+    prevIdx = array('i', [-1] * len(summary))
+    last = -1
+    for idx, item in enumerate(summary):
+        if item == ord('S'):
+            if last >= 0:
+                nextIdx[last] = idx
+            prevIdx[idx] = last
+            last = idx
+    return (nextIdx, prevIdx)
+
+def removeSurvivor(summary, links, idx):
+    (nextIdx, prevIdx) = links
+    summary[idx] = '-'
+    if prevIdx[idx] >= 0:
+        nextIdx[prevIdx[idx]] = nextIdx[idx]
+    if nextIdx[idx] < len(summary):
+        prevIdx[nextIdx[idx]] = prevIdx[idx]
+
+def prevSurvivor(summary, links, idx):
+    """Index of the last surviving chunk before idx."""
+    (nextIdx, prevIdx) = links
+    idx = prevIdx[idx]
+    # A removed chunk keeps its links, which may lead to other removed chunks.
+    while idx >= 0 and summary[idx] != ord('S'):
+        idx = prevIdx[idx]
+    if idx < 0:
+        raise ValueError("S is not in list")
+    return idx
+
+def nextSurvivor(summary, links, idx):
+    """Index of the first surviving chunk after idx."""
+    (nextIdx, prevIdx) = links
+    idx = nextIdx[idx]
+    while idx < len(summary) and summary[idx] != ord('S'):
+        idx = nextIdx[idx]
+    if idx >= len(summary):
+        raise ValueError("S is not in list")
+    return idx
 
 def tryRemovingSurroundingChunks(chunkSize):
     """Make a single run through the testcase, trying to remove chunks of size chunkSize.
@@ -499,7 +963,8 @@ def tryRemovingSurroundingChunks(chunkSize):
 
     print "Starting a round with chunks of " + quantity(chunkSize, atom) + "."
 
-    summary = ['S' for i in range(numChunks)]
+    summary = bytearray('S' * numChunks)
+    links = survivorLinks(summary)
     chunkStart = chunkSize
     beforeChunkIdx = 0
     keepChunkIdx = 1
@@ -513,25 +978,27 @@ def tryRemovingSurroundingChunks(chunkSize):
             chunkAftEnd = min(len(parts), chunkAftStart + chunkSize)
             description = "chunk #" + str(beforeChunkIdx) + " & #" + str(afterChunkIdx) + " of " + str(numChunks) + " chunks of size " + str(chunkSize)
 
-            if interesting(parts[:chunkBefStart] + parts[chunkBefEnd:chunkAftStart] + parts[chunkAftEnd:]):
+            removed = [(chunkBefStart, chunkBefEnd), (chunkAftStart, chunkAftEnd)]
+            if interestingWithout(removed):
+                parts = partsWithout(removed)
                 print "Yay, reduced it by removing " + description + " :)"
                 chunksRemoved += 2
                 atomsRemoved += (chunkBefEnd - chunkBefStart)
                 atomsRemoved += (chunkAftEnd - chunkAftStart)
-                summary[beforeChunkIdx] = '-'
-                summary[afterChunkIdx] = '-'
+                removeSurvivor(summary, links, beforeChunkIdx)
+                removeSurvivor(summary, links, afterChunkIdx)
                 # The start is now sooner since we remove the chunk which was before this one.
                 chunkStart -= chunkSize
                 try:
                     # Try to keep removing surrounding chunks of the same part.
-                    beforeChunkIdx = list_rindex(summary, keepChunkIdx, 'S')
+                    beforeChunkIdx = prevSurvivor(summary, links, keepChunkIdx)
                 except ValueError:
                     # There is no more survinving block on the left-hand-side of
                     # the current chunk, shift everything by one surviving
                     # block. Any ValueError from here means that there is no
                     # longer enough chunk.
                     beforeChunkIdx = keepChunkIdx
-                    keepChunkIdx = list_nindex(summary, keepChunkIdx, 'S')
+                    keepChunkIdx = nextSurvivor(summary, links, keepChunkIdx)
                     chunkStart += chunkSize
             else:
                 print "Removing " + description + " made the file 'uninteresting'."
@@ -541,21 +1008,20 @@ def tryRemovingSurroundingChunks(chunkSize):
                 keepChunkIdx = afterChunkIdx
                 chunkStart += chunkSize
 
-            afterChunkIdx = list_nindex(summary, keepChunkIdx, 'S')
+            afterChunkIdx = nextSurvivor(summary, links, keepChunkIdx)
 
     except ValueError:
         # This is a valid loop exit point.
         chunkStart = len(parts)
 
     atomsSurviving = atomsInitial - atomsRemoved
-    printableSummary = " ".join(["".join(summary[(2 * i):min(2 * (i + 1), numChunks + 1)]) for i in range(numChunks / 2 + numChunks % 2)])
     print ""
     print "Done with a round of chunk size " + str(chunkSize) + "!"
     print quantity(summary.count('S'), "chunk") + " survived; " + \
           quantity(summary.count('-'), "chunk") + " removed."
     print quantity(atomsSurviving, atom) + " survived; " + \
           quantity(atomsRemoved, atom) + " removed."
-    print "Which chunks survived: " + printableSummary
+    print "Which chunks survived: " + printableSummary(summary)
     print ""
 
     writeTestcaseTemp("did-round-" + str(chunkSize), True);
@@ -582,7 +1048,7 @@ def tryRemovingSurroundingChunks(chunkSize):
 def minimizeBalancedPairs():
     origNumParts = len(parts)
     chunkSize = min(minimizeMax, largestPowerOfTwoSmallerThan(origNumParts))
-    finalChunkSize = max(minimizeMin, 1)
+    finalChunkSize = min(chunkSize, max(minimizeMin, 1))
 
     while 1:
         anyChunksRemoved = tryRemovingBalancedPairs(chunkSize);
@@ -596,8 +1062,9 @@ def minimizeBalancedPairs():
             # Done
             break
         else:
-            # Continue with the next smaller chunk size
-            chunkSize /= 2
+            # Continue with the next smaller chunk size, skipping the sizes
+            # which are too large for what remains of the testcase.
+            chunkSize = max(finalChunkSize, min(chunkSize / 2, largestPowerOfTwoSmallerThan(len(parts))))
 
     writeTestcase(testcaseFilename)
 
@@ -611,6 +1078,22 @@ def minimizeBalancedPairs():
     print "  Tests performed: " + str(testCount)
     print "  Test total: " + quantity(testTotal, atom)
 
+def bracketBalance(text):
+    """Count how many curly, square and normal brackets are opened by a text,
+    minus how many are closed."""
+    return (text.count('{') - text.count('}'),
+            text.count('[') - text.count(']'),
+            text.count('(') - text.count(')'))
+
+def partBracketBalance(part):
+    """Same as bracketBalance, for a single part.  The result is remembered, as
+    single parts are often repeated, such as in char mode."""
+    balance = bracketBalances.get(part)
+    if balance == None:
+        balance = bracketBalance(part)
+        bracketBalances[part] = balance
+    return balance
+
 def list_fiveParts(list, step, f, s, t):
     return (list[:f], list[f:s], list[s:(s+step)], list[(s+step):(t+step)], list[(t+step):])
 
@@ -637,21 +1120,27 @@ def tryRemovingBalancedPairs(chunkSize):
 
     print "Starting a round with chunks of " + quantity(chunkSize, atom) + "."
 
-    summary = ['S' for i in range(numChunks)]
-    curly = [(parts[i].count('{') - parts[i].count('}')) for i in range(numChunks)]
-    square = [(parts[i].count('{') - parts[i].count('}')) for i in range(numChunks)]
-    normal = [(parts[i].count('(') - parts[i].count(')')) for i in range(numChunks)]
+    summary = bytearray('S' * numChunks)
+    links = survivorLinks(summary)
+    curly = [0] * numChunks
+    square = [0] * numChunks
+    normal = [0] * numChunks
+    for i in range(numChunks):
+        if chunkSize == 1:
+            (curly[i], square[i], normal[i]) = partBracketBalance(parts[i])
+        else:
+            # Count the brackets of the whole chunk at once.
+            chunkText = "".join(parts[(i * chunkSize):((i + 1) * chunkSize)])
+            (curly[i], square[i], normal[i]) = bracketBalance(chunkText)
     chunkStart = 0
     lhsChunkIdx = 0
 
     try:
         while chunkStart < len(parts):
 
-            description = "chunk #" + str(lhsChunkIdx) + "".join([" " for i in range(len(str(lhsChunkIdx)) + 4)])
+            description = "chunk #" + str(lhsChunkIdx) + " " * (len(str(lhsChunkIdx)) + 4)
             description += " of " + str(numChunks) + " chunks of size " + str(chunkSize)
 
-            assert summary[:lhsChunkIdx].count('S') * chunkSize == chunkStart, "the chunkStart should correspond to the lhsChunkIdx modulo the removed chunks."
-
             chunkLhsStart = chunkStart
             chunkLhsEnd = min(len(parts), chunkLhsStart + chunkSize)
 
@@ -661,23 +1150,25 @@ def tryRemovingBalancedPairs(chunkSize):
 
             # If the chunk is already balanced, try to remove it.
             if nCurly == 0 and nSquare == 0 and nNormal == 0:
-                if interesting(parts[:chunkLhsStart] + parts[chunkLhsEnd:]):
+                if interestingWithout([(chunkLhsStart, chunkLhsEnd)]):
+                    parts = partsWithout([(chunkLhsStart, chunkLhsEnd)])
                     print "Yay, reduced it by removing " + description + " :)"
                     chunksRemoved += 1
                     atomsRemoved += (chunkLhsEnd - chunkLhsStart)
-                    summary[lhsChunkIdx] = '-'
+                    removeSurvivor(summary, links, lhsChunkIdx)
                 else:
                     print "Removing " + description + " made the file 'uninteresting'."
                     chunkStart += chunkSize
-                lhsChunkIdx = list_nindex(summary, lhsChunkIdx, 'S')
+                lhsChunkIdx = nextSurvivor(summary, links, lhsChunkIdx)
                 continue
 
-            # Otherwise look for the corresponding chunk.
-            rhsChunkIdx = lhsChunkIdx
-            for item in summary[(lhsChunkIdx + 1):]:
-                rhsChunkIdx += 1
-                if item != 'S':
-                    continue
+            # Otherwise look for the corresponding chunk, following the links
+            # between the surviving chunks, and counting the surviving chunks
+            # from the lhs chunk to the rhs chunk.
+            nextIdx = links[0]
+            rhsChunkIdx = nextIdx[lhsChunkIdx]
+            survivorsBetween = 1
+            while rhsChunkIdx < numChunks:
                 nCurly += curly[rhsChunkIdx]
                 nSquare += square[rhsChunkIdx]
                 nNormal += normal[rhsChunkIdx]
@@ -685,30 +1176,34 @@ def tryRemovingBalancedPairs(chunkSize):
                     break
                 if nCurly == 0 and nSquare == 0 and nNormal == 0:
                     break
+                rhsChunkIdx = nextIdx[rhsChunkIdx]
+                survivorsBetween += 1
 
             # If we have no match, then just skip this pair of chunks.
             if nCurly != 0 or nSquare != 0 or nNormal != 0:
                 print "Skipping " + description + " because it is 'uninteresting'."
                 chunkStart += chunkSize
-                lhsChunkIdx = list_nindex(summary, lhsChunkIdx, 'S')
+                lhsChunkIdx = nextSurvivor(summary, links, lhsChunkIdx)
                 continue
 
             # Otherwise we do have a match and we check if this is interesting to remove both.
-            chunkRhsStart = chunkLhsStart + chunkSize * summary[lhsChunkIdx:rhsChunkIdx].count('S')
+            chunkRhsStart = chunkLhsStart + chunkSize * survivorsBetween
             chunkRhsStart = min(len(parts), chunkRhsStart)
             chunkRhsEnd = min(len(parts), chunkRhsStart + chunkSize)
 
             description = "chunk #" + str(lhsChunkIdx) + " & #" + str(rhsChunkIdx)
             description += " of " + str(numChunks) + " chunks of size " + str(chunkSize)
 
-            if interesting(parts[:chunkLhsStart] + parts[chunkLhsEnd:chunkRhsStart] + parts[chunkRhsEnd:]):
+            removed = [(chunkLhsStart, chunkLhsEnd), (chunkRhsStart, chunkRhsEnd)]
+            if interestingWithout(removed):
+                parts = partsWithout(removed)
                 print "Yay, reduced it by removing " + description + " :)"
                 chunksRemoved += 2
                 atomsRemoved += (chunkLhsEnd - chunkLhsStart)
                 atomsRemoved += (chunkRhsEnd - chunkRhsStart)
-                summary[lhsChunkIdx] = '-'
-                summary[rhsChunkIdx] = '-'
-                lhsChunkIdx = list_nindex(summary, lhsChunkIdx, 'S')
+                removeSurvivor(summary, links, lhsChunkIdx)
+                removeSurvivor(summary, links, rhsChunkIdx)
+                lhsChunkIdx = nextSurvivor(summary, links, lhsChunkIdx)
                 continue
 
             # Removing the braces make the failure disappear.  As we are looking
@@ -721,16 +1216,16 @@ def tryRemovingBalancedPairs(chunkSize):
             # If you want to try it, just replace this True by a False.
             if True:
                 chunkStart += chunkSize
-                lhsChunkIdx = list_nindex(summary, lhsChunkIdx, 'S')
+                lhsChunkIdx = nextSurvivor(summary, links, lhsChunkIdx)
                 continue
 
             origChunkIdx = lhsChunkIdx
             stayOnSameChunk = False
             chunkMidStart = chunkLhsEnd
-            midChunkIdx = list_nindex(summary, lhsChunkIdx, 'S')
+            midChunkIdx = nextSurvivor(summary, links, lhsChunkIdx)
             while chunkMidStart < chunkRhsStart:
                 assert summary[:midChunkIdx].count('S') * chunkSize == chunkMidStart, "the chunkMidStart should correspond to the midChunkIdx modulo the removed chunks."
-                description = "chunk #" + str(midChunkIdx) + "".join([" " for i in range(len(str(lhsChunkIdx)) + 4)])
+                description = "chunk #" + str(midChunkIdx) + " " * (len(str(lhsChunkIdx)) + 4)
                 description += " of " + str(numChunks) + " chunks of size " + str(chunkSize)
 
                 chunkMidEnd = chunkMidStart + chunkSize
@@ -742,7 +1237,7 @@ def tryRemovingBalancedPairs(chunkSize):
                 if nCurly != 0 or nSquare != 0 or nNormal != 0:
                     print "Keepping " + description + " because it is 'uninteresting'."
                     chunkMidStart += chunkSize
-                    midChunkIdx = list_nindex(summary, midChunkIdx, 'S')
+                    midChunkIdx = nextSurvivor(summary, links, midChunkIdx)
                     continue
 
                 # Try moving the chunk after.
@@ -758,6 +1253,7 @@ def tryRemovingBalancedPairs(chunkSize):
                     curly =   tc[0] + tc[1] + tc[3] + tc[2] + tc[4]
                     square =  ts[0] + ts[1] + ts[3] + ts[2] + ts[4]
                     normal =  tn[0] + tn[1] + tn[3] + tn[2] + tn[4]
+                    links = survivorLinks(summary)
                     rhsChunkIdx -= 1
                     midChunkIdx = summary[midChunkIdx:].index('S') + midChunkIdx
                     continue
@@ -776,19 +1272,20 @@ def tryRemovingBalancedPairs(chunkSize):
                     curly =   tc[0] + tc[2] + tc[1] + tc[3] + tc[4]
                     square =  ts[0] + ts[2] + ts[1] + ts[3] + ts[4]
                     normal =  tn[0] + tn[2] + tn[1] + tn[3] + tn[4]
+                    links = survivorLinks(summary)
                     lhsChunkIdx += 1
-                    midChunkIdx = list_nindex(summary, midChunkIdx, 'S')
+                    midChunkIdx = nextSurvivor(summary, links, midChunkIdx)
                     stayOnSameChunk = True
                     continue
 
                 print "..Moving " + description + " made the file 'uninteresting'."
                 chunkMidStart += chunkSize
-                midChunkIdx = list_nindex(summary, midChunkIdx, 'S')
+                midChunkIdx = nextSurvivor(summary, links, midChunkIdx)
 
             lhsChunkIdx = origChunkIdx
             if not stayOnSameChunk:
                 chunkStart += chunkSize
-                lhsChunkIdx = list_nindex(summary, lhsChunkIdx, 'S')
+                lhsChunkIdx = nextSurvivor(summary, links, lhsChunkIdx)
 
 
     except ValueError:
@@ -796,14 +1293,13 @@ def tryRemovingBalancedPairs(chunkSize):
         chunkStart = len(parts)
 
     atomsSurviving = atomsInitial - atomsRemoved
-    printableSummary = " ".join(["".join(summary[(2 * i):min(2 * (i + 1), numChunks + 1)]) for i in range(numChunks / 2 + numChunks % 2)])
     print ""
     print "Done with a round of chunk size " + str(chunkSize) + "!"
     print quantity(summary.count('S'), "chunk") + " survived; " + \
           quantity(summary.count('-'), "chunk") + " removed."
     print quantity(atomsSurviving, atom) + " survived; " + \
           quantity(atomsRemoved, atom) + " removed."
-    print "Which chunks survived: " + printableSummary
+    print "Which chunks survived: " + printableSummary(summary)
     print ""
 
     writeTestcaseTemp("did-round-" + str(chunkSize), True);
@@ -830,7 +1326,7 @@ def tryRemovingBalancedPairs(chunkSize):
 #
 def replacePropertiesByGlobals():
     origNumParts = len(parts)
-    chunkSize = min(minimizeMax, 2 * largestPowerOfTwoSmallerThan(origNumParts))
+    chunkSize = minimizeMax
     finalChunkSize = max(minimizeMin, 1)
 
     origNumChars = 0
@@ -867,6 +1363,43 @@ def replacePropertiesByGlobals():
     print "  Test total: " + quantity(testTotal, atom)
 
 
+# Property accesses, such as "this.list" in "this.list.push(a)".
+propertyPattern = re.compile(r'(?<=[\w\d_])\.(\w+)')
+
+# Characters which can be part of the prefix of a property, and the runs of
+# such characters.
+prefixChars = frozenset(string.ascii_letters + string.digits + "_.")
+prefixRunPattern = re.compile(r'[\w.]*')
+
+def stripPrefixes(line, word):
+    """Replace the prefixed uses of a property word by the word alone, such as
+    "this.list" by "list".
+
+    This does the same as re.sub("[\w_.]+\." + word, word, line), without
+    backtracking over long runs of prefix characters: a prefix goes from the
+    start of its run to the last occurrence of the property in the run."""
+    pattern = "." + word
+    result = []
+    start = 0
+    search = 0
+    while True:
+        dot = line.find(pattern, search)
+        if dot == -1:
+            break
+        if dot == start or line[dot - 1] not in prefixChars:
+            # Nothing in front of this occurrence to strip.
+            search = dot + 1
+            continue
+        runStart = dot - 1
+        while runStart > start and line[runStart - 1] in prefixChars:
+            runStart -= 1
+        runEnd = prefixRunPattern.match(line, dot + len(pattern)).end()
+        result.append(line[start:runStart])
+        result.append(word)
+        start = search = line.rfind(pattern, dot, runEnd) + len(pattern)
+    result.append(line[start:])
+    return "".join(result)
+
 def tryMakingGlobals(chunkSize, numChars):
     """Make a single run through the testcase, trying to remove chunks of size chunkSize.
 
@@ -881,30 +1414,22 @@ def tryMakingGlobals(chunkSize, numChars):
     finalChunkSize = max(minimizeMin, 1)
 
     # Map words to the chunk indexes in which they are present.
-    words = {}
+    words = defaultdict(set)
     for chunk, line in enumerate(parts):
-        for match in re.finditer(r'(?<=[\w\d_])\.(\w+)', line):
-            word = match.group(1)
-            if not word in words:
-                words[word] = [chunk]
-            else:
-                words[word] += [chunk]
+        for match in propertyPattern.finditer(line):
+            words[match.group(1)].add(chunk)
 
     # All patterns have been removed sucessfully.
     if len(words) == 0:
         return 0
 
     print "Starting a round with chunks of " + quantity(chunkSize, atom) + "."
-    summary = ['S' for i in range(numChunks)]
+    summary = bytearray('S' * numChunks)
 
     for word, chunks in words.items():
-        chunkIndexes = {}
+        chunkIndexes = defaultdict(list)
         for chunkStart in chunks:
-            chunkIdx = int(chunkStart / chunkSize)
-            if not chunkIdx in chunkIndexes:
-                chunkIndexes[chunkIdx] = [chunkStart]
-            else:
-                chunkIndexes[chunkIdx] += [chunkStart]
+            chunkIndexes[chunkStart // chunkSize].append(chunkStart)
 
         for chunkIdx, chunkStarts in chunkIndexes.items():
             # Unless this is the final size, let's try to remove couple of
@@ -916,32 +1441,30 @@ def tryMakingGlobals(chunkSize, numChars):
             description = "'" + word + "' in "
             description += "chunk #" + str(chunkIdx) + " of " + str(numChunks) + " chunks of size " + str(chunkSize)
 
-            maybeRemoved = 0
-            newParts = parts
-            for chunkStart in chunkStarts:
-                subst = re.sub("[\w_.]+\." + word, word, newParts[chunkStart])
-                maybeRemoved += len(newParts[chunkStart]) - len(subst)
-                newParts = newParts[:chunkStart] + [ subst ] + newParts[(chunkStart+1):]
+            edits = dict([(chunkStart, stripPrefixes(parts[chunkStart], word)) for chunkStart in chunkStarts])
+            maybeRemoved = sum([len(parts[chunkStart]) - len(subst) for chunkStart, subst in edits.items()])
+            newParts = parts[:]
+            for chunkStart, subst in edits.items():
+                newParts[chunkStart] = subst
 
             if interesting(newParts):
                 print "Yay, reduced it by removing prefixes of " + description + " :)"
                 numRemovedChars += maybeRemoved
                 summary[chunkIdx] = 's'
-                words[word] = [ c for c in chunks if c not in chunkIndexes ]
-                if len(words[word]) == 0:
+                chunks.difference_update(chunkStarts)
+                if len(chunks) == 0:
                     del words[word]
             else:
                 print "Removing prefixes of " + description + " made the file 'uninteresting'."
 
     numSurvivingChars = numChars - numRemovedChars
-    printableSummary = " ".join(["".join(summary[(2 * i):min(2 * (i + 1), numChunks + 1)]) for i in range(numChunks / 2 + numChunks % 2)])
     print ""
     print "Done with a round of chunk size " + str(chunkSize) + "!"
     print quantity(summary.count('S'), "chunk") + " survived; " + \
           quantity(summary.count('s'), "chunk") + " shortened."
     print quantity(numSurvivingChars, "character") + " survived; " + \
           quantity(numRemovedChars, "character") + " removed."
-    print "Which chunks survived: " + printableSummary
+    print "Which chunks survived: " + printableSummary(summary)
     print ""
 
     writeTestcaseTemp("did-round-" + str(chunkSize), True);
@@ -991,6 +1514,16 @@ def replaceArgumentsByGlobals():
     print "  Test total: " + quantity(testTotal, atom)
 
 
+# Function definitions with at least one argument.
+functionDefPattern = re.compile(r'(?:function\s+(\w+)|(\w+)\s*=\s*function)\s*\((\s*\w+\s*(?:,\s*\w+\s*)*)\)')
+# Anonymous function definitions, which are surrounded by parentheses, and
+# calls of anonymous functions.  They are matched in a single pass, so that
+# each call is paired with the right definition.
+anonymousPattern = re.compile(r'(?P<def>\(function\s*\w*\s*\((?P<defArgs>(?:\s*\w+\s*(?:,\s*\w+\s*)*)?)\)\s*{)' +
+                              r'|(?P<call>}\s*\)\s*\((?P<callArgs>(?:[^()]|\([^,()]*\))*)\))')
+# Function calls, and some definitions.
+functionCallPattern = re.compile(r'((\w+)\s*\(((?:[^()]|\([^,()]*\))*)\))')
+
 def tryArgumentsAsGlobals(roundNum):
     """Make a single run through the testcase, trying to remove chunks of size chunkSize.
     
@@ -1007,7 +1540,7 @@ def tryArgumentsAsGlobals(roundNum):
     anonymousStack = []
     for chunk, line in enumerate(parts):
         # Match function definition with at least one argument.
-        for match in re.finditer(r'(?:function\s+(\w+)|(\w+)\s*=\s*function)\s*\((\s*\w+\s*(?:,\s*\w+\s*)*)\)', line):
+        for match in functionDefPattern.finditer(line):
             fun = match.group(1)
             if fun is None:
                 fun = match.group(2)
@@ -1025,32 +1558,31 @@ def tryArgumentsAsGlobals(roundNum):
                 functions[fun]["chunk"] = chunk
 
 
-        # Match anonymous function definition, which are surrounded by parentheses.
-        for match in re.finditer(r'\(function\s*\w*\s*\(((?:\s*\w+\s*(?:,\s*\w+\s*)*)?)\)\s*{', line):
-            if match.group(1) == "":
-                args = []
-            else:
-                args = match.group(1).split(',')
-            anonymousStack += [{ "defs": args, "chunk": chunk, "use": None, "useChunk": 0 }]
+        # Match anonymous function definitions and their calls.
+        for match in anonymousPattern.finditer(line):
+            if match.lastgroup == "def":
+                if match.group("defArgs") == "":
+                    args = []
+                else:
+                    args = match.group("defArgs").split(',')
+                anonymousStack.append({ "defs": args, "chunk": chunk, "use": None, "useChunk": 0 })
+                continue
 
-        # Match calls of anonymous function.
-        for match in re.finditer(r'}\s*\)\s*\(((?:[^()]|\([^,()]*\))*)\)', line):
             if len(anonymousStack) == 0:
                 continue
-            anon = anonymousStack[-1]
-            anonymousStack = anonymousStack[:-1]
-            if match.group(1) == "" and len(anon["defs"]) == 0:
+            anon = anonymousStack.pop()
+            if match.group("callArgs") == "" and len(anon["defs"]) == 0:
                 continue
-            if match.group(1) == "":
+            if match.group("callArgs") == "":
                 args = []
             else:
-                args = match.group(1).split(',')
+                args = match.group("callArgs").split(',')
             anon["use"] = args
             anon["useChunk"] = chunk
             anonymousQueue += [anon]
 
         # match function calls. (and some definitions)
-        for match in re.finditer(r'((\w+)\s*\(((?:[^()]|\([^,()]*\))*)\))', line):
+        for match in functionCallPattern.finditer(line):
             pattern = match.group(1)
             fun = match.group(2)
             if match.group(3) == "":
@@ -1059,7 +1591,7 @@ def tryArgumentsAsGlobals(roundNum):
                 args = match.group(3).split(',')
             if not fun in functions:
                 functions[fun] = { "uses": [] }
-            functions[fun]["uses"] += [{ "values": args, "chunk": chunk, "pattern": pattern }]
+            functions[fun]["uses"].append({ "values": args, "chunk": chunk, "pattern": pattern })
 
 
     # All patterns have been removed sucessfully.
@@ -1070,30 +1602,34 @@ def tryArgumentsAsGlobals(roundNum):
 
     for fun, argsMap in functions.items():
         description = "arguments of '" + fun + "'"
-        if "defs" not in argsMap or len(argsMap["uses"]) == 0:
+        uses = argsMap["uses"]
+        if "defs" not in argsMap or len(uses) == 0:
             print "Ignoring " + description + " because it is 'uninteresting'."
             continue
 
         maybeMovedArguments = 0
-        newParts = parts
+        newParts = parts[:]
 
         # Remove the function definition arguments
         argDefs = argsMap["defs"]
+        numDefs = len(argDefs)
         defChunk = argsMap["chunk"]
-        subst = string.replace(newParts[defChunk], argsMap["argsPattern"], "", 1)
-        newParts = newParts[:defChunk] + [ subst ] + newParts[(defChunk+1):]
+        argsPattern = argsMap["argsPattern"]
+        line = newParts[defChunk]
+        if line.find(argsPattern) != -1:
+            newParts[defChunk] = line.replace(argsPattern, "", 1)
 
         # Copy callers arguments to globals.
-        for argUse in argsMap["uses"]:
+        for argUse in uses:
             values = argUse["values"]
             chunk = argUse["chunk"]
             if chunk == defChunk and values == argDefs:
                 continue
-            while len(values) < len(argDefs):
-                values = values + ["undefined"]
-            setters = "".join([ a + " = " + v + ";\n" for a, v in zip(argDefs, values) ])
+            if len(values) < numDefs:
+                values = values + ["undefined"] * (numDefs - len(values))
+            setters = "".join(["%s = %s;\n" % (a, v) for a, v in zip(argDefs, values)])
             subst = setters + newParts[chunk]
-            newParts = newParts[:chunk] + [ subst ] + newParts[(chunk+1):]
+            newParts[chunk] = subst
             maybeMovedArguments += len(values);
 
         if interesting(newParts):
@@ -1103,17 +1639,21 @@ def tryArgumentsAsGlobals(roundNum):
             numSurvivedArguments += maybeMovedArguments
             print "Removing " + description + " made the file 'uninteresting'."
 
-        for argUse in argsMap["uses"]:
+        emptyCall = fun + "()"
+        for argUse in uses:
             chunk = argUse["chunk"]
             values = argUse["values"]
             if chunk == defChunk and values == argDefs:
                 continue
 
-            newParts = parts
-            subst = string.replace(newParts[chunk], argUse["pattern"], fun + "()", 1)
-            if newParts[chunk] == subst:
+            # Skip the lines where the replacement would not change anything.
+            line = parts[chunk]
+            pattern = argUse["pattern"]
+            if pattern not in line or pattern == emptyCall:
                 continue
-            newParts = newParts[:chunk] + [ subst ] + newParts[(chunk+1):]
+            subst = line.replace(pattern, emptyCall, 1)
+            newParts = parts[:]
+            newParts[chunk] = subst
             maybeMovedArguments = len(values);
 
             descriptionChunk = description + " at " + atom + " #" + str(chunk)
@@ -1128,7 +1668,7 @@ def tryArgumentsAsGlobals(roundNum):
     for anon in anonymousQueue:
         noopChanges = 0
         maybeMovedArguments = 0
-        newParts = parts
+        newParts = parts[:]
 
         argDefs = anon["defs"]
         defChunk = anon["chunk"]
@@ -1137,25 +1677,30 @@ def tryArgumentsAsGlobals(roundNum):
         description = "arguments of anonymous function at #" + atom + " " + str(defChunk)
 
         # Remove arguments of the function.
-        subst = string.replace(newParts[defChunk], ",".join(argDefs), "", 1)
-        if newParts[defChunk] == subst:
+        pattern = ",".join(argDefs)
+        line = newParts[defChunk]
+        if pattern and line.find(pattern) != -1:
+            newParts[defChunk] = line.replace(pattern, "", 1)
+        else:
             noopChanges += 1
-        newParts = newParts[:defChunk] + [ subst ] + newParts[(defChunk+1):]
 
         # Replace arguments by their value in the scope of the function.
-        while len(values) < len(argDefs):
-            values = values + ["undefined"]
-        setters = "".join([ "var " + a + " = " + v + ";\n" for a, v in zip(argDefs, values) ])
+        numDefs = len(argDefs)
+        if len(values) < numDefs:
+            values = values + ["undefined"] * (numDefs - len(values))
+        setters = "".join(["var %s = %s;\n" % (a, v) for a, v in zip(argDefs, values)])
         subst = newParts[defChunk] + "\n" + setters
         if newParts[defChunk] == subst:
             noopChanges += 1
-        newParts = newParts[:defChunk] + [ subst ] + newParts[(defChunk+1):]
+        newParts[defChunk] = subst
 
         # Remove arguments of the anonymous function call.
-        subst = string.replace(newParts[chunk], ",".join(anon["use"]), "", 1)
-        if newParts[chunk] == subst:
+        pattern = ",".join(anon["use"])
+        line = newParts[chunk]
+        if pattern and line.find(pattern) != -1:
+            newParts[chunk] = line.replace(pattern, "", 1)
+        else:
             noopChanges += 1
-        newParts = newParts[:chunk] + [ subst ] + newParts[(chunk+1):]
         maybeMovedArguments += len(values);
 
         if noopChanges == 3:
@@ -1179,6 +1724,70 @@ def tryArgumentsAsGlobals(roundNum):
     return numMovedArguments
 
 
+#
+# This Strategy is the delta debugging algorithm (ddmin) by Andreas Zeller.  The
+# testcase is split in n subsets.  Lithium tries to keep only one of them, then
+# to remove one of them.  If neither is interesting, the subsets are split in
+# two, until they only contain one atom.
+#
+def ddmin():
+    global parts
+
+    origNumParts = len(parts)
+    n = 2
+
+    while len(parts) >= 2:
+        numParts = len(parts)
+        subsets = [(i * numParts // n, (i + 1) * numParts // n) for i in range(n)]
+        reduced = False
+
+        # Try keeping only one subset.
+        for i, (start, end) in enumerate(subsets):
+            description = "all but subset #" + str(i + 1) + " of " + str(n)
+            if interestingWithout([r for r in [(0, start), (end, numParts)] if r[0] < r[1]]):
+                print "Yay, reduced it by removing " + description + " :)"
+                parts = parts[start:end]
+                n = 2
+                reduced = True
+                break
+            print "Removing " + description + " made the file 'uninteresting'."
+
+        # Try removing one subset.  With 2 subsets, this was just done.
+        if not reduced and n > 2:
+            for i, (start, end) in enumerate(subsets):
+                description = "subset #" + str(i + 1) + " of " + str(n)
+                if interestingWithout([(start, end)]):
+                    print "Yay, reduced it by removing " + description + " :)"
+                    parts = partsWithout([(start, end)])
+                    n = max(n - 1, 2)
+                    reduced = True
+                    break
+                print "Removing " + description + " made the file 'uninteresting'."
+
+        if not reduced:
+            if n >= numParts:
+                break
+            n = min(n * 2, numParts)
+            print "Splitting the testcase in " + str(n) + " subsets."
+
+    # The loop stops before trying to remove the last atom.
+    if len(parts) == 1:
+        if interestingWithout([(0, 1)]):
+            print "Yay, reduced it by removing the last " + atom + " :)"
+            parts = []
+        else:
+            print "Removing the last " + atom + " made the file 'uninteresting'."
+
+    writeTestcase(testcaseFilename)
+
+    print "Lithium is done!"
+    print "  Removing any single " + atom + " from the final file makes it uninteresting!"
+    print "  Initial size: " + quantity(origNumParts, atom)
+    print "  Final size: " + quantity(len(parts), atom)
+    print "  Tests performed: " + str(testCount)
+    print "  Test total: " + quantity(testTotal, atom)
+
+
 # Other reduction algorithms
 # (Use these if you're really frustrated with something you know is 1-minimal.)
 
@@ -1187,32 +1796,35 @@ def tryRemovingAdjacentPairs():
     # XXX capture the idea that after removing (4,5) it might be sensible to remove (3,6)
     # but also that after removing (2,3) and (4,5) it might be sensible to remove (1,6)
     # XXX also want to remove three at a time, and two at a time that are one line apart
-    for i in range(0, numParts - 2):
-        if enabled[i]:
-            enabled[i] = False
-            enabled[i + 1] = False
-            if interesting():
-                print "Removed an adjacent pair based at " + str(i)
-            else:
-                enabled[i] = True
-                enabled[i + 1] = True
-    # Restore the original testcase
+    global parts
+
+    removed = []
+    i = 0
+    while i < len(parts) - 1:
+        if interestingWithout(removed + [(i, i + 2)]):
+            print "Removed an adjacent pair based at " + str(i)
+            removed.append((i, i + 2))
+            i += 2
+        else:
+            i += 1
+    parts = partsWithout(removed)
+
     writeTestcase(testcaseFilename)
     print "Done with one pass of removing adjacent pairs"
 
 
 
 def tryRemovingPair():
-    for i in range(0, numParts):
-        enabled[i] = False
-        for j in range(i + 1, numParts):
-            enabled[j] = False
+    global parts
+
+    for i in range(0, len(parts)):
+        for j in range(i + 1, len(parts)):
             print "Trying removing the pair " + str(i) + ", " + str(j)
-            if interesting():
+            if interestingWithout([(i, i + 1), (j, j + 1)]):
+                parts = partsWithout([(i, i + 1), (j, j + 1)])
+                writeTestcase(testcaseFilename)
                 print "Success!  Removed a pair!  Exiting."
                 sys.exit(0)
-            enabled[j] = True
-        enabled[i] = True
 
     # Restore the original testcase
     writeTestcase(testcaseFilename)
@@ -1220,15 +1832,16 @@ def tryRemovingPair():
             
 
 def tryRemovingSubstring():
-    for i in range(0, numParts):
-        for j in range(i, numParts):
-            enabled[j] = False
+    global parts
+
+    for i in range(0, len(parts)):
+        for j in range(i, len(parts)):
             print "Trying removing the substring " + str(i) + ".." + str(j)
-            if interesting():
+            if interestingWithout([(i, j + 1)]):
+                parts = partsWithout([(i, j + 1)])
+                writeTestcase(testcaseFilename)
                 print "Success!  Removed a substring!  Exiting."
                 sys.exit(0)
-        for j in range(i, numParts):
-            enabled[j] = True
 
     # Restore the original testcase
     writeTestcase(testcaseFilename)
@@ -1238,23 +1851,16 @@ def tryRemovingSubstring():
 # Helpers
 
 def divideRoundingUp(n, d):
-    return (n // d) + (1 if n % d != 0 else 0)
+    return -(-n // d)
 
 def isPowerOfTwo(n):
-    i = 1
-    while 1:
-        if i == n:
-            return True
-        if i > n:
-            return False
-        i *= 2
-    
+    return n > 0 and (n & (n - 1)) == 0
+
 def largestPowerOfTwoSmallerThan(n):
-    i = 1
-    while 1:
-        if i * 2 >= n:
-            return i
-        i *= 2
+    # Chunk sizes never go below 1.
+    if n <= 2:
+        return 1
+    return 1 << ((n - 1).bit_length() - 1)
 
 def quantity(n, s):
     """Convert a quantity to a string, with correct pluralization."""
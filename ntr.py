@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import os, signal, sys, time, platform, subprocess
+import errno, threading
 
 exitBadUsage = 2
 
@@ -37,8 +38,23 @@ def xpkill(p):
         return win32process.TerminateProcess(process._handle, -1)
 
 
+def writeInput(pipe, input):
+    """Write the input to the pipe and close it.  The child may exit without
+    reading all of its input, which is not an error."""
+    try:
+        try:
+            if input != None:
+                pipe.write(input)
+        finally:
+            pipe.close()
+    except IOError, e:
+        if e.errno not in (errno.EPIPE, errno.EINVAL):
+            raise
+
+
 def timed_run(commandWithArgs, timeout, logPrefix, input=None):
-    '''If logPrefix is None, uses pipes instead of files for all output.'''
+    '''If logPrefix is None, uses pipes instead of files for all output.
+    If input is given, it is written to the standard input of the command.'''
 
     if not isinstance(commandWithArgs, list):
         raise TypeError, "commandWithArgs should be a list (of strings)."
@@ -66,7 +82,7 @@ def timed_run(commandWithArgs, timeout, logPrefix, input=None):
     try:
         child = subprocess.Popen(
             commandWithArgs,
-            stdin = (None         if useLogFiles else subprocess.PIPE),
+            stdin = (None         if useLogFiles and input == None else subprocess.PIPE),
             stderr = (childStdErr if useLogFiles else subprocess.PIPE),
             stdout = (childStdOut if useLogFiles else subprocess.PIPE),
             close_fds = (os.name == "posix") # would be nice to use this everywhere, but it's broken on Windows (http://docs.python.org/library/subprocess.html)
@@ -78,9 +94,12 @@ def timed_run(commandWithArgs, timeout, logPrefix, input=None):
         print "  " + str(e)
         sys.exit(2)
 
-    if not useLogFiles:
-        child.stdin.write(input)
-        child.stdin.close()
+    if child.stdin:
+        # Feed the input from another thread, so that the timeout still
+        # applies if the child does not read it.
+        writer = threading.Thread(target=writeInput, args=(child.stdin, input))
+        writer.daemon = True
+        writer.start()
 
     sta = NONE
     msg = ''
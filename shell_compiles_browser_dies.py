@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import ntr, os, subprocess
+import hashlib
 
 # usage: put the js in a separate file from html.  give the js filename to lithium as --testcase and to this script as jsfile.
 # for example:
@@ -9,9 +10,21 @@ import ntr, os, subprocess
 jsshell = os.path.expanduser("~/tracemonkey/js/src/debug/js")
 jsfile = "c.js"
 
+# Exit codes of the compilation, by SHA-1 digest of the js file.
+compileResults = {}
+
 def interesting(args, tempPrefix):
     timeout = int(args[0])
-    returncode = subprocess.call([jsshell, "-C", jsfile], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    f = open(jsfile, "rb")
+    digest = hashlib.sha1(f.read()).digest()
+    f.close()
+    returncode = compileResults.get(digest)
+    if returncode == None:
+        # The output is not read, and a full pipe would block the js shell.
+        devnull = open(os.devnull, "wb")
+        returncode = subprocess.call([jsshell, "-C", jsfile], stdout=devnull, stderr=devnull)
+        devnull.close()
+        compileResults[digest] = returncode
     if returncode != 0:
         print "JS didn't compile, skipping browser test"
         return False